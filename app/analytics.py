@@ -0,0 +1,274 @@
+"""Columnar prediction log with incremental hourly rollups.
+
+Every prediction outcome is appended to an in-memory buffer that a background
+thread writes out as Parquet files partitioned by date::
+
+    PREDICTION_LOG_DIR/date=2026-01-31/part-<time>-<pid>-<id>.parquet
+
+Each flush also adds its rows to per-day rollup files (counts per status and
+class for every hour and plot), so dashboards can answer questions such as
+"infection rate by plot per day" without scanning the raw rows.
+
+Every flush from every worker writes its own small part file. Once a day is
+over, the writer threads merge that day's parts into a single
+``compacted.parquet`` (checked every COMPACTION_INTERVAL seconds), so each
+closed day ends up as one file. Rows that arrive for a closed day later are
+folded in on the next pass.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from filelock import FileLock
+
+from .services import CLASSES
+
+COUNT_COLUMNS = {
+    'Healthy': 'healthy_count',
+    'Infected Leaf': 'infected_leaf_count',
+    'Disease Part': 'disease_part_count',
+}
+CONFIDENCE_COLUMNS = {
+    'Healthy': 'healthy_confidence',
+    'Infected Leaf': 'infected_leaf_confidence',
+    'Disease Part': 'disease_part_confidence',
+}
+CATEGORY_COLUMNS = ('source', 'plot', 'status')
+COMPACTED_FILE = 'compacted.parquet'
+COMPACTION_INTERVAL = 3600  # Seconds between checks for closed days to compact
+# Outcomes without a verdict, left out of the infection rate denominator
+UNSCORED_STATUSES = ('Error', 'Dropped')
+
+
+class PredictionLog:
+    """Buffered writer for the prediction log and its rollups."""
+
+    def __init__(self, directory=None, batch_size=None, flush_interval=None):
+        self.directory = directory or settings.PREDICTION_LOG_DIR
+        self.batch_size = batch_size or settings.PREDICTION_LOG_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.PREDICTION_LOG_FLUSH_INTERVAL
+        self.rollup_dir = os.path.join(self.directory, 'rollups')
+        os.makedirs(self.rollup_dir, exist_ok=True)
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.last_compaction = 0.0
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def append(self, row):
+        """Queue one prediction row; it is written on the next flush."""
+        with self.lock:
+            self.buffer.append(row)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wakeup.set()
+
+    def _flush_loop(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing prediction log: {e}")
+            if time.time() - self.last_compaction > COMPACTION_INTERVAL:
+                self.last_compaction = time.time()
+                try:
+                    self.compact_closed_days()
+                except Exception as e:
+                    print(f"Error compacting prediction log: {e}")
+
+    def flush(self):
+        """Write all buffered rows to Parquet and update the rollups."""
+        with self.flush_lock:
+            with self.lock:
+                rows, self.buffer = self.buffer, []
+            if not rows:
+                return
+
+            import pandas as pd
+
+            df = pd.DataFrame(rows)
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+            for column in COUNT_COLUMNS.values():
+                df[column] = df[column].astype('int16')
+            for column in CONFIDENCE_COLUMNS.values():
+                df[column] = df[column].astype('float32')
+            df['processing_time'] = df['processing_time'].astype('float32')
+            df['resolution'] = df['resolution'].astype('int16')
+            for column in CATEGORY_COLUMNS:
+                df[column] = df[column].astype('category')
+
+            stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+            for day, part in df.groupby(df['timestamp'].dt.strftime('%Y-%m-%d')):
+                partition = os.path.join(self.directory, f'date={day}')
+                os.makedirs(partition, exist_ok=True)
+                filename = f'part-{stamp}-{os.getpid()}-{uuid.uuid4().hex[:8]}.parquet'
+                part.to_parquet(os.path.join(partition, filename), index=False, compression='snappy')
+                self._update_rollups(day, part)
+
+    def compact_closed_days(self):
+        """Merge the part files of every day before today into one file per day."""
+        today = date.today().isoformat()
+        for entry in os.scandir(self.directory):
+            if entry.is_dir() and entry.name.startswith('date=') and entry.name[len('date='):] < today:
+                self.compact_partition(entry.name[len('date='):])
+
+    def compact_partition(self, day):
+        """Merge one day's part files, and any earlier compacted file, into COMPACTED_FILE."""
+        partition = os.path.join(self.directory, f'date={day}')
+        # Every worker compacts, so take turns; the lock lives outside the dataset
+        with FileLock(os.path.join(self.rollup_dir, f'compact-{day}.lock')):
+            parts = sorted(name for name in os.listdir(partition)
+                           if name.startswith('part-') and name.endswith('.parquet'))
+            if not parts:
+                return
+
+            import pandas as pd
+
+            compacted = os.path.join(partition, COMPACTED_FILE)
+            files = ([compacted] if os.path.exists(compacted) else []) + [os.path.join(partition, name)
+                                                                          for name in parts]
+            df = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+            for column in CATEGORY_COLUMNS:
+                # Parts have different category sets, which concat turns into objects
+                df[column] = df[column].astype('category')
+            df = df.sort_values('timestamp', kind='stable')
+
+            tmp_path = os.path.join(partition, f'.{COMPACTED_FILE}.{os.getpid()}.tmp')
+            df.to_parquet(tmp_path, index=False, compression='snappy')
+            os.replace(tmp_path, compacted)
+            for name in parts:
+                os.remove(os.path.join(partition, name))
+            print(f"Compacted {len(parts)} prediction log parts for {day}")
+
+    def _update_rollups(self, day, df):
+        """Add a batch of rows from one day to that day's hourly rollup."""
+        batch = {}
+        for row in df.itertuples(index=False):
+            hour = row.timestamp.strftime('%H')
+            bucket = batch.setdefault(hour, {}).setdefault(row.plot, _empty_bucket())
+            bucket['total'] += 1
+            bucket['status'][row.status] = bucket['status'].get(row.status, 0) + 1
+            for class_name, column in COUNT_COLUMNS.items():
+                bucket['classes'][class_name] += int(getattr(row, column))
+
+        path = os.path.join(self.rollup_dir, f'{day}.json')
+        # Rollups are shared by every worker, so merge under a file lock
+        with FileLock(f'{path}.lock'):
+            rollup = _read_json(path)
+            for hour, plots in batch.items():
+                for plot, counts in plots.items():
+                    bucket = rollup.setdefault(hour, {}).setdefault(plot, _empty_bucket())
+                    bucket['total'] += counts['total']
+                    for status, count in counts['status'].items():
+                        bucket['status'][status] = bucket['status'].get(status, 0) + count
+                    for class_name, count in counts['classes'].items():
+                        bucket['classes'][class_name] += count
+
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(rollup, f)
+            os.replace(tmp_path, path)
+
+
+def _empty_bucket():
+    return {'total': 0, 'status': {}, 'classes': {cls: 0 for cls in CLASSES}}
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_prediction_log():
+    """Return the process-wide prediction log, starting its writer on first use."""
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = PredictionLog()
+    return _log
+
+
+def log_prediction(status, results=None, processing_time=0.0, resolution=0, plot='', source='predict',
+                   prediction_id=None, timestamp=None):
+    """Append a prediction outcome to the log.
+
+    ``results`` is the per-class dictionary returned by ``predict_image``; it is
+    omitted for failed predictions, which are logged with status ``'Error'``,
+    and for requests shed before inference, logged as ``'Dropped'``. Batch jobs
+    should pass ``source='batch'``.
+    """
+    if not settings.PREDICTION_LOG_ENABLED:
+        return
+
+    row = {
+        'timestamp': timestamp or datetime.now(),
+        'prediction_id': prediction_id or str(uuid.uuid4()),
+        'source': source,
+        'plot': plot or '',
+        'status': status,
+        'processing_time': float(processing_time),
+        'resolution': int(resolution),
+    }
+    for class_name in CLASSES:
+        class_results = (results or {}).get(class_name, {})
+        row[COUNT_COLUMNS[class_name]] = class_results.get('count', 0)
+        row[CONFIDENCE_COLUMNS[class_name]] = class_results.get('avg_confidence', 0.0)
+
+    try:
+        get_prediction_log().append(row)
+    except Exception as e:
+        # Analytics must never break a prediction
+        print(f"Error logging prediction: {e}")
+
+
+def query_rollups(start, end, plot=None, granularity='day'):
+    """Return rollup buckets between two dates (inclusive).
+
+    ``granularity`` is ``'hour'`` or ``'day'``. When ``plot`` is given only that
+    plot is included, otherwise all plots are summed. The infection rate only
+    counts predictions that produced a result.
+    """
+    rollup_dir = os.path.join(settings.PREDICTION_LOG_DIR, 'rollups')
+    buckets = {}
+
+    day = start
+    while day <= end:
+        rollup = _read_json(os.path.join(rollup_dir, f'{day.isoformat()}.json'))
+        for hour, plots in sorted(rollup.items()):
+            key = f'{day.isoformat()}T{hour}:00' if granularity == 'hour' else day.isoformat()
+            for plot_name, counts in plots.items():
+                if plot is not None and plot_name != plot:
+                    continue
+                bucket = buckets.setdefault(key, _empty_bucket())
+                bucket['total'] += counts['total']
+                for status, count in counts['status'].items():
+                    bucket['status'][status] = bucket['status'].get(status, 0) + count
+                for class_name, count in counts['classes'].items():
+                    bucket['classes'][class_name] = bucket['classes'].get(class_name, 0) + count
+        day += timedelta(days=1)
+
+    rows = []
+    for key, bucket in sorted(buckets.items()):
+        scored = bucket['total'] - sum(bucket['status'].get(status, 0) for status in UNSCORED_STATUSES)
+        bucket['period'] = key
+        bucket['infection_rate'] = bucket['status'].get('Infected', 0) / scored if scored else None
+        rows.append(bucket)
+    return rows
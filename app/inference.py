@@ -0,0 +1,405 @@
+"""Out-of-process inference service for the leaf disease detector.
+
+Web workers preprocess images themselves and hand the pixel data to a fixed
+pool of inference processes through shared memory. Only a small JSON header
+(shared memory name, shape and dtype) travels over the Unix domain socket, so
+no pixel data is pickled or copied through the socket.
+
+The supervisor owns the listening socket and queues every request centrally.
+It hands a request to a worker only when that worker is idle, so a worker busy
+on a large image never has connections piling up behind it.
+"""
+import json
+import os
+import select
+import signal
+import socket
+import struct
+import threading
+import time
+import multiprocessing
+import queue
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+from django.conf import settings
+
+from . import metrics
+from .scheduling import (CANCEL_POLL_INTERVAL, DEFAULT_PRIORITY, InferenceScheduler, RequestCancelled,
+                         socket_closed)
+
+# Every message is a 4-byte big-endian length followed by a JSON body
+HEADER = struct.Struct('!I')
+RESTART_BACKOFF = 1.0  # Seconds to wait between restarts of a crashed worker
+
+_served_version = None
+
+
+def served_model_version():
+    """Return the model version in this process's latest service response, or None."""
+    return _served_version
+
+
+def send_message(sock, payload):
+    """Send a length-prefixed JSON message."""
+    data = json.dumps(payload).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    """Read exactly ``size`` bytes or raise ConnectionError on EOF."""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("Inference socket closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_message(sock):
+    """Receive a length-prefixed JSON message."""
+    (size,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return json.loads(_recv_exactly(sock, size).decode('utf-8'))
+
+
+class InferenceClient:
+    """Client used by web workers to run detection on the inference service."""
+
+    def __init__(self, socket_path=None, timeout=None, retries=None):
+        self.socket_path = socket_path or settings.INFERENCE_SOCKET_PATH
+        self.timeout = settings.INFERENCE_TIMEOUT if timeout is None else timeout
+        self.retries = settings.INFERENCE_RETRIES if retries is None else retries
+
+    def detect(self, img, imgsz=None, priority=DEFAULT_PRIORITY, deadline=None, is_cancelled=None):
+        """Send a preprocessed BGR image to the service.
+
+        ``deadline`` is a ``time.monotonic()`` value after which the service drops
+        the request instead of running it. ``is_cancelled`` is polled while
+        waiting for the response; once it returns True the connection is closed,
+        which drops the request from the service's queue, and RequestCancelled
+        is raised. Returns the detections and the version of the model that
+        produced them.
+        """
+        global _served_version
+        img = np.ascontiguousarray(img)
+        shm = shared_memory.SharedMemory(create=True, size=max(img.nbytes, 1))
+        try:
+            np.ndarray(img.shape, dtype=img.dtype, buffer=shm.buf)[:] = img
+            request = {
+                'priority': priority,
+                'shm': shm.name,
+                'shape': list(img.shape),
+                'dtype': str(img.dtype),
+            }
+            if imgsz is not None:
+                request['imgsz'] = imgsz
+
+            last_error = None
+            for attempt in range(self.retries + 1):
+                if deadline is not None:
+                    # Monotonic clocks aren't comparable across processes, so send the time left
+                    request['timeout'] = deadline - time.monotonic()
+                try:
+                    response = self._call(request, is_cancelled)
+                except RequestCancelled:
+                    metrics.incr(f'scheduler.dropped.{priority}')
+                    raise
+                except (ConnectionRefusedError, FileNotFoundError) as e:
+                    # The service is restarting and never saw the request, so it
+                    # can be resent
+                    last_error = e
+                    print(f"Inference request failed (attempt {attempt + 1}): {e}")
+                    time.sleep(RESTART_BACKOFF * attempt)
+                    continue
+                except ConnectionError as e:
+                    # The service accepted the request and then went away. The
+                    # frame itself may have crashed it, so don't resend it.
+                    raise RuntimeError(f"Inference service closed the connection: {e}")
+                except TimeoutError:
+                    # A slow service may still be working on this frame; resending
+                    # it would only double the load, so give up instead
+                    raise RuntimeError("Inference service timed out")
+
+                # The service's scheduler runs in another process, so its
+                # queueing metrics are recorded here with the web worker's
+                if response.get('cancelled'):
+                    metrics.incr(f'scheduler.dropped.{priority}')
+                    raise RequestCancelled(response.get('error'))
+                if 'queue_seconds' in response:
+                    metrics.observe(f'scheduler.queue_seconds.{priority}', response['queue_seconds'])
+                if not response.get('ok'):
+                    raise RuntimeError(f"Inference failed: {response.get('error')}")
+                _served_version = response['model_version']
+                return [tuple(detection) for detection in response['detections']], response['model_version']
+
+            raise RuntimeError(f"Inference service unavailable: {last_error}")
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def reload(self):
+        """Ask every inference worker to reload the model in the background."""
+        response = self._call({'reload': True})
+        if not response.get('ok'):
+            raise RuntimeError(f"Model reload failed: {response.get('error')}")
+        return response
+
+    def _call(self, request, is_cancelled=None):
+        """Perform one request/response round trip on a fresh connection."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            send_message(sock, request)
+
+            # Allow for time spent queued behind higher-priority requests
+            give_up = time.monotonic() + self.timeout + max(request.get('timeout', 0), 0)
+            while is_cancelled is not None:
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Timed out waiting for the inference service")
+                readable, _, _ = select.select([sock], [], [], min(CANCEL_POLL_INTERVAL, remaining))
+                if readable:
+                    break
+                if is_cancelled():
+                    # Leaving the block closes the socket, which the supervisor
+                    # sees as a disconnect and drops the request
+                    raise RequestCancelled("Request cancelled: client disconnected")
+
+            sock.settimeout(max(give_up - time.monotonic(), 0.001))
+            return recv_message(sock)
+
+
+class InferenceWorker:
+    """A single inference process that owns one copy of the model.
+
+    The worker handles one request at a time from its pipe to the supervisor,
+    so it only ever receives work when it is idle.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.detector = None
+
+    def run(self):
+        """Load the model and serve requests until the supervisor goes away."""
+        # Let the supervisor handle Ctrl+C; workers are stopped with SIGTERM
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # The supervisor sends SIGHUP to request a model reload
+        signal.signal(signal.SIGHUP, self._handle_reload)
+
+        import torch
+        from .services import LeafDiseaseDetector
+
+        if settings.INFERENCE_TORCH_THREADS > 0:
+            torch.set_num_threads(settings.INFERENCE_TORCH_THREADS)
+
+        self.detector = LeafDiseaseDetector()
+        self.detector.load_model()
+        print(f"Inference worker {os.getpid()} ready")
+
+        with self.conn:
+            while True:
+                try:
+                    request = recv_message(self.conn)
+                except (ConnectionError, OSError):
+                    return
+                send_message(self.conn, self.handle_request(request))
+
+    def _handle_reload(self, signum, frame):
+        # A worker still loading its first model picks up the current weights anyway
+        if self.detector is not None:
+            self.detector.reload_model_async()
+
+    def handle_request(self, request):
+        """Run detection on the image referenced by a request."""
+        try:
+            shm = shared_memory.SharedMemory(name=request['shm'])
+        except FileNotFoundError:
+            return {'ok': False, 'error': f"Shared memory block {request['shm']} not found"}
+
+        try:
+            # The client owns the block; stop our resource tracker from unlinking it
+            resource_tracker.unregister(shm._name, 'shared_memory')
+            img = np.ndarray(tuple(request['shape']), dtype=np.dtype(request['dtype']),
+                             buffer=shm.buf).copy()
+        finally:
+            shm.close()
+
+        try:
+            if 'imgsz' in request:
+                detections, version = self.detector.detect_with_version(img, imgsz=request['imgsz'])
+            else:
+                detections, version = self.detector.detect_with_version(img)
+            return {'ok': True, 'detections': detections, 'model_version': version}
+        except Exception as e:
+            print(f"Inference worker {os.getpid()} error: {e}")
+            return {'ok': False, 'error': str(e)}
+
+
+def _run_worker(conn):
+    import django
+    django.setup()
+    InferenceWorker(conn).run()
+
+
+class WorkerHandle:
+    """A worker process and the supervisor's end of its pipe."""
+
+    def __init__(self, context):
+        self.conn, child_conn = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.process = context.Process(target=_run_worker, args=(child_conn,), daemon=True)
+        # SIGHUP's default action is to exit. Start the worker with it ignored,
+        # which survives the exec, so a reload request can't kill it before
+        # run() installs its handler.
+        previous = signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            self.process.start()
+        finally:
+            signal.signal(signal.SIGHUP, previous)
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class InferenceServer:
+    """Supervisor that queues requests and keeps a fixed pool of inference workers running."""
+
+    def __init__(self, socket_path=None, workers=None):
+        self.socket_path = socket_path or settings.INFERENCE_SOCKET_PATH
+        self.num_workers = workers or settings.INFERENCE_WORKERS
+        self.workers = []
+        self.idle_workers = queue.Queue()
+        # One slot per worker; waiting requests are ordered by priority class.
+        # Clients record the queueing metrics from the responses.
+        self.scheduler = InferenceScheduler(concurrency=self.num_workers, record_metrics=False)
+        self.listener = None
+        self.running = False
+
+    def serve_forever(self):
+        """Bind the socket, start the workers and restart any that die."""
+        if not self.socket_path:
+            raise ValueError("INFERENCE_SOCKET_PATH is not configured")
+
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        # Spawn rather than fork: the supervisor is multi-threaded
+        context = multiprocessing.get_context('spawn')
+        for _ in range(self.num_workers):
+            worker = WorkerHandle(context)
+            self.workers.append(worker)
+            self.idle_workers.put(worker)
+
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(128)
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload_workers())
+        print(f"Inference server listening on {self.socket_path} with {self.num_workers} workers")
+
+        try:
+            while self.running:
+                for i, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        print(f"Inference worker {worker.process.pid} exited with code "
+                              f"{worker.process.exitcode}, restarting")
+                        worker.stop()
+                        self.workers[i] = WorkerHandle(context)
+                        self.idle_workers.put(self.workers[i])
+                time.sleep(RESTART_BACKOFF)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stop all workers and remove the socket."""
+        self.running = False
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                # The listener was closed during shutdown
+                return
+            threading.Thread(target=self._handle_client, args=(conn,), daemon=True).start()
+
+    def _handle_client(self, conn):
+        """Answer requests on one client connection until it is closed."""
+        with conn:
+            while True:
+                try:
+                    request = recv_message(conn)
+                    send_message(conn, self._dispatch(request, conn))
+                except (ConnectionError, OSError):
+                    # The client went away
+                    return
+
+    def reload_workers(self):
+        """Signal every worker to load, warm up and swap in the weights at MODEL_PATH."""
+        for worker in self.workers:
+            if worker.is_alive():
+                os.kill(worker.process.pid, signal.SIGHUP)
+        print(f"Requested a model reload from {len(self.workers)} inference workers")
+        return len(self.workers)
+
+    def _dispatch(self, request, conn):
+        """Queue a request for a free worker and return the worker's response."""
+        if request.get('reload'):
+            return {'ok': True, 'workers': self.reload_workers()}
+
+        deadline = None
+        if 'timeout' in request:
+            deadline = time.monotonic() + request['timeout']
+
+        try:
+            with self.scheduler.slot(request.get('priority', DEFAULT_PRIORITY), deadline,
+                                     lambda: socket_closed(conn)) as queued:
+                worker = self._take_idle_worker()
+                try:
+                    send_message(worker.conn, request)
+                    response = recv_message(worker.conn)
+                except (ConnectionError, OSError) as e:
+                    # Answer rather than drop the client, which would retry the
+                    # frame on another worker; it may be what killed this one.
+                    # The monitor loop replaces the worker.
+                    print(f"Inference worker {worker.process.pid} failed mid-request: {e}")
+                    if worker.is_alive():
+                        worker.process.terminate()
+                    return {'ok': False, 'error': "Inference worker exited while handling the request"}
+                self.idle_workers.put(worker)
+                response['queue_seconds'] = queued
+                return response
+        except RequestCancelled as e:
+            return {'ok': False, 'cancelled': True, 'error': str(e)}
+
+    def _take_idle_worker(self):
+        while True:
+            worker = self.idle_workers.get()
+            # A worker that died while idle is replaced by the monitor loop
+            if worker.is_alive():
+                return worker
+
+    def _handle_signal(self, signum, frame):
+        self.running = False
@@ -0,0 +1,126 @@
+"""Adaptive input-resolution load shedding.
+
+The number of requests being processed across all web workers is tracked with
+one ticket file per request in a shared directory. When that depth crosses the
+configured thresholds the inference resolution steps down a tier, and it steps
+back up only once the depth has fallen a hysteresis margin below the threshold.
+
+Tickets of live requests are touched periodically so that a request waiting in
+a bulk or background queue is never mistaken for one left behind by a killed
+worker, however long its deadline.
+"""
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+class InFlightTracker:
+    """Count in-flight requests across processes using ticket files."""
+
+    def __init__(self, directory=None, stale_after=None):
+        self.directory = directory or settings.INFLIGHT_DIR
+        self.stale_after = settings.INFLIGHT_STALE_SECONDS if stale_after is None else stale_after
+        os.makedirs(self.directory, exist_ok=True)
+        self.tickets = set()
+        self.lock = threading.Lock()
+        self.heartbeat = None
+
+    @contextmanager
+    def track(self):
+        """Mark one request as in flight for the duration of the block."""
+        ticket = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex}")
+        open(ticket, 'w').close()
+        with self.lock:
+            self.tickets.add(ticket)
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self._refresh_tickets, daemon=True)
+                self.heartbeat.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.tickets.discard(ticket)
+            try:
+                os.remove(ticket)
+            except FileNotFoundError:
+                pass
+
+    def _refresh_tickets(self):
+        """Keep the tickets of this process's live requests from going stale."""
+        while True:
+            time.sleep(self.stale_after / 4)
+            with self.lock:
+                tickets = list(self.tickets)
+            for ticket in tickets:
+                try:
+                    os.utime(ticket)
+                except FileNotFoundError:
+                    # Finished meanwhile, or removed as stale by another worker
+                    pass
+
+    def depth(self):
+        """Return the number of requests currently in flight."""
+        now = time.time()
+        depth = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if now - entry.stat().st_mtime > self.stale_after:
+                    # Left behind by a worker that was killed mid-request
+                    os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            depth += 1
+        return depth
+
+
+class AdaptiveResolution:
+    """Pick an inference resolution tier from the current request depth."""
+
+    def __init__(self, tiers=None, thresholds=None, hysteresis=None):
+        self.tiers = list(tiers or settings.ADAPTIVE_RESOLUTION_TIERS)
+        self.thresholds = list(thresholds or settings.ADAPTIVE_RESOLUTION_THRESHOLDS)
+        self.hysteresis = settings.ADAPTIVE_RESOLUTION_HYSTERESIS if hysteresis is None else hysteresis
+        if len(self.thresholds) != len(self.tiers) - 1:
+            raise ValueError("ADAPTIVE_RESOLUTION_THRESHOLDS needs one entry fewer than ADAPTIVE_RESOLUTION_TIERS")
+        self.level = 0
+        self.lock = threading.Lock()
+
+    def select(self, depth):
+        """Update the current tier for ``depth`` and return its resolution."""
+        with self.lock:
+            # thresholds[i] is the depth at which tier i steps down to tier i + 1
+            while self.level < len(self.thresholds) and depth >= self.thresholds[self.level]:
+                self.level += 1
+            while self.level > 0 and depth < self.thresholds[self.level - 1] - self.hysteresis:
+                self.level -= 1
+            return self.tiers[self.level]
+
+
+_tracker = None
+_controller = None
+
+
+def get_tracker():
+    """Return the process-wide in-flight tracker."""
+    global _tracker
+    if _tracker is None:
+        _tracker = InFlightTracker()
+    return _tracker
+
+
+def select_resolution(default):
+    """Return the inference resolution to use for a request entering now.
+
+    Returns ``default`` when adaptive resolution is disabled.
+    """
+    global _controller
+    if not settings.ADAPTIVE_RESOLUTION:
+        return default
+    if _controller is None:
+        _controller = AdaptiveResolution()
+    return _controller.select(get_tracker().depth())
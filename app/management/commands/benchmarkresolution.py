@@ -0,0 +1,68 @@
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.services import LeafDiseaseDetector, CLASSES
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class Command(BaseCommand):
+    help = ("Benchmark throughput and detection agreement at each adaptive resolution tier. "
+            "Agreement is measured against the first (highest) tier.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', help="Directory of sample leaf images.")
+        parser.add_argument('--tiers', default=','.join(str(t) for t in settings.ADAPTIVE_RESOLUTION_TIERS),
+                            help="Comma-separated resolutions to compare, highest first.")
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Timed passes over the images per tier.")
+
+    def handle(self, *args, **options):
+        image_dir = options['images']
+        if not os.path.isdir(image_dir):
+            raise CommandError(f"Image directory not found: {image_dir}")
+
+        image_paths = sorted(
+            os.path.join(image_dir, name) for name in os.listdir(image_dir)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not image_paths:
+            raise CommandError(f"No {', '.join(IMAGE_EXTENSIONS)} images found in {image_dir}")
+
+        tiers = [int(t) for t in options['tiers'].split(',')]
+        detector = LeafDiseaseDetector()
+        detector.load_model()
+
+        # Warm up so the first tier does not pay for lazy initialization
+        detector.analyze_image(image_paths[0], tiers[0])
+
+        baseline = None
+        self.stdout.write(f"{len(image_paths)} images, {options['repeat']} passes per tier\n")
+        self.stdout.write(f"{'tier':>6} {'img/s':>8} {'mean ms':>8} {'p95 ms':>8} {'status':>8} {'counts':>8}")
+
+        for tier in tiers:
+            latencies = []
+            outcomes = []
+            for _ in range(options['repeat']):
+                outcomes = []
+                for image_path in image_paths:
+                    start = time.perf_counter()
+                    _, results = detector.analyze_image(image_path, tier)
+                    latencies.append(time.perf_counter() - start)
+                    outcomes.append((detector.get_status(results),
+                                     tuple(results[cls]['count'] for cls in CLASSES)))
+
+            if baseline is None:
+                baseline = outcomes
+            status_agreement = np.mean([a[0] == b[0] for a, b in zip(outcomes, baseline)])
+            count_agreement = np.mean([a[1] == b[1] for a, b in zip(outcomes, baseline)])
+
+            self.stdout.write(
+                f"{tier:>6} {len(latencies) / sum(latencies):>8.2f} "
+                f"{np.mean(latencies) * 1000:>8.1f} {np.percentile(latencies, 95) * 1000:>8.1f} "
+                f"{status_agreement:>8.1%} {count_agreement:>8.1%}"
+            )
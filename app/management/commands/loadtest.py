@@ -0,0 +1,275 @@
+import argparse
+import base64
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DEFAULT_MIX = 'predict_file=60,predict_camera=20,result=10,image_result=10'
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Command(BaseCommand):
+    help = ("Drive /predict/, /result/ and /image/result/ with an open-loop arrival process "
+            "and report throughput, error rate and latency percentiles against SLOs. "
+            "Latency is measured from each request's scheduled start time, so it is "
+            "corrected for coordinated omission. Uploads get random trailing bytes so each "
+            "one has a new content hash and goes through preprocessing and inference rather "
+            "than the prediction cache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Base URL of a running server. When omitted a local server is started.")
+        parser.add_argument('--server', choices=['gunicorn', 'runserver'], default='gunicorn',
+                            help="Local server to start when --url is not given.")
+        parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers for the local server.")
+        parser.add_argument('--port', type=int, default=0, help="Port for the local server (0 picks a free one).")
+        parser.add_argument('--corpus', default=settings.LOADTEST_CORPUS_DIR,
+                            help="Directory of sample images to upload.")
+        parser.add_argument('--rps', type=float, default=5.0, help="Target arrival rate in requests per second.")
+        parser.add_argument('--duration', type=float, default=60.0, help="Test duration in seconds.")
+        parser.add_argument('--arrival', choices=['poisson', 'constant'], default='poisson',
+                            help="Inter-arrival distribution.")
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help="Comma-separated scenario=weight pairs.")
+        parser.add_argument('--slo', action='append', default=[],
+                            help="Latency SLO such as p95=2.0 (seconds). May be repeated.")
+        parser.add_argument('--max-error-rate', type=float, default=0.01,
+                            help="Largest acceptable fraction of failed requests.")
+        parser.add_argument('--max-concurrency', type=int, default=256,
+                            help="Upper bound on simultaneous client requests.")
+        parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for arrivals and scenario choice.")
+        parser.add_argument('--cache-bust', action=argparse.BooleanOptionalAction, default=True,
+                            help="Make every upload's content unique so predictions aren't served from the "
+                                 "cache. --no-cache-bust measures cache hits for the corpus images instead.")
+
+    def handle(self, *args, **options):
+        self.images = self._load_corpus(options['corpus'])
+        self.timeout = options['timeout']
+        self.cache_bust = options['cache_bust']
+        mix = self._parse_mix(options['mix'])
+        slos = self._parse_slos(options['slo'])
+
+        server = None
+        base_url = options['url']
+        if not base_url:
+            port = options['port'] or self._free_port()
+            server = self._start_server(options['server'], port, options['workers'])
+            base_url = f"http://127.0.0.1:{port}"
+        self.base_url = base_url.rstrip('/')
+
+        try:
+            if not server:
+                self._wait_until_ready()
+            self.session_cookies = self._prime_sessions()
+            samples = self._run(mix, options)
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=10)
+
+        if not self._report(samples, options['duration'], slos, options['max_error_rate']):
+            raise CommandError("SLO violated")
+
+    def _load_corpus(self, corpus_dir):
+        if not os.path.isdir(corpus_dir):
+            raise CommandError(f"Corpus directory not found: {corpus_dir}")
+        images = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(corpus_dir, name), 'rb') as f:
+                    images.append((name, f.read()))
+        if not images:
+            raise CommandError(f"No {', '.join(IMAGE_EXTENSIONS)} images found in {corpus_dir}")
+        return images
+
+    def _parse_mix(self, mix):
+        scenarios = {}
+        for pair in mix.split(','):
+            name, _, weight = pair.partition('=')
+            if not hasattr(self, f'_scenario_{name}'):
+                raise CommandError(f"Unknown scenario: {name}")
+            scenarios[name] = float(weight or 1)
+        return scenarios
+
+    def _parse_slos(self, slos):
+        parsed = {}
+        for slo in slos:
+            name, _, limit = slo.partition('=')
+            if not name.startswith('p') or not limit:
+                raise CommandError(f"Invalid SLO {slo!r}, expected something like p95=2.0")
+            parsed[float(name[1:])] = float(limit)
+        return parsed
+
+    def _free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def _start_server(self, kind, port, workers):
+        if kind == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', 'main.wsgi:application',
+                       '--bind', f'127.0.0.1:{port}', '--workers', str(workers)]
+        else:
+            command = [sys.executable, 'manage.py', 'runserver', '--noreload', f'127.0.0.1:{port}']
+        self.stdout.write(f"Starting {kind} on port {port}")
+        server = subprocess.Popen(command, cwd=settings.BASE_DIR)
+        self.base_url = f"http://127.0.0.1:{port}"
+        try:
+            self._wait_until_ready()
+        except CommandError:
+            server.terminate()
+            raise
+        return server
+
+    def _wait_until_ready(self, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                requests.get(f"{self.base_url}/", timeout=2)
+                return
+            except requests.RequestException:
+                time.sleep(0.5)
+        raise CommandError(f"Server at {self.base_url} did not become ready")
+
+    def _prime_sessions(self):
+        """Run one prediction per corpus image so /result/ requests have a session.
+
+        This also puts every corpus image in the prediction cache, so with
+        --no-cache-bust the /predict/ scenarios measure cache hits.
+        """
+        cookies = []
+        for name, data in self.images:
+            response = requests.post(f"{self.base_url}/predict/", files={'image': (name, data)},
+                                     headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=self.timeout)
+            if response.ok and response.json().get('success'):
+                cookies.append(response.cookies.get_dict())
+        if not cookies:
+            raise CommandError("Could not create any prediction sessions; is the model available?")
+        return cookies
+
+    def _upload(self, rng):
+        """Pick a corpus image, made unique unless cache busting is off."""
+        name, data = rng.choice(self.images)
+        if self.cache_bust:
+            # Decoders stop at the JPEG/PNG end marker, so trailing bytes change
+            # the content hash without changing the pixels
+            data += rng.getrandbits(128).to_bytes(16, 'big')
+        return name, data
+
+    def _scenario_predict_file(self, rng):
+        name, data = self._upload(rng)
+        response = requests.post(f"{self.base_url}/predict/", files={'image': (name, data)},
+                                 headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=self.timeout)
+        return response.ok and response.json().get('success', False)
+
+    def _scenario_predict_camera(self, rng):
+        name, data = self._upload(rng)
+        mime = 'png' if name.lower().endswith('.png') else 'jpeg'
+        camera_image = f"data:image/{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        response = requests.post(f"{self.base_url}/predict/", data={'camera_image': camera_image},
+                                 headers={'X-Requested-With': 'XMLHttpRequest'}, timeout=self.timeout)
+        return response.ok and response.json().get('success', False)
+
+    def _scenario_result(self, rng):
+        # A redirect means the session was lost, which counts as an error
+        response = requests.get(f"{self.base_url}/result/", cookies=rng.choice(self.session_cookies),
+                                allow_redirects=False, timeout=self.timeout)
+        return response.status_code == 200
+
+    def _scenario_image_result(self, rng):
+        response = requests.get(f"{self.base_url}/image/result/", cookies=rng.choice(self.session_cookies),
+                                allow_redirects=False, timeout=self.timeout)
+        return response.status_code == 200
+
+    def _run(self, mix, options):
+        rng = random.Random(options['seed'])
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        samples = []
+        samples_lock = threading.Lock()
+
+        def execute(scenario, scheduled, seed):
+            started = time.perf_counter()
+            try:
+                ok = getattr(self, f'_scenario_{scenario}')(random.Random(seed))
+            except (requests.RequestException, ValueError):
+                ok = False
+            finished = time.perf_counter()
+            with samples_lock:
+                # Latency from the scheduled start includes any time spent waiting
+                # for a free client thread, so a slow server can't hide its backlog
+                samples.append((scenario, ok, finished - scheduled, finished - started, finished - start))
+
+        self.stdout.write(f"Running {options['arrival']} arrivals at {options['rps']} rps for {options['duration']}s")
+        start = time.perf_counter()
+        next_arrival = 0.0
+        with ThreadPoolExecutor(max_workers=options['max_concurrency']) as executor:
+            while next_arrival < options['duration']:
+                scheduled = start + next_arrival
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                scenario = rng.choices(names, weights)[0]
+                executor.submit(execute, scenario, scheduled, rng.random())
+
+                if options['arrival'] == 'poisson':
+                    next_arrival += rng.expovariate(options['rps'])
+                else:
+                    next_arrival += 1.0 / options['rps']
+
+        return samples
+
+    def _report(self, samples, duration, slos, max_error_rate):
+        """Print the results and return whether all SLOs were met.
+
+        ``offered`` is the rate requests were sent at over the test duration.
+        ``tput`` is the rate of successful completions over the wall-clock time
+        from the start to the last completion, so it falls below ``offered``
+        when the server can't keep up.
+        """
+        if not samples:
+            self.stderr.write("No requests were sent")
+            return False
+
+        elapsed = max(s[4] for s in samples)
+        self.stdout.write(f"\nLast request completed after {elapsed:.1f}s of a {duration:g}s test")
+        self.stdout.write(f"\n{'scenario':<16} {'reqs':>6} {'err%':>6} {'offered':>7} {'tput':>7} "
+                          + ' '.join(f"{'p' + str(p):>7}" for p in PERCENTILES)
+                          + f" {'max':>7} {'svc p95':>8}")
+
+        groups = sorted({s[0] for s in samples}) + ['all']
+        for group in groups:
+            rows = [s for s in samples if group == 'all' or s[0] == group]
+            latencies = np.array([s[2] for s in rows])
+            errors = sum(1 for s in rows if not s[1])
+            self.stdout.write(
+                f"{group:<16} {len(rows):>6} {errors / len(rows):>6.1%} "
+                f"{len(rows) / duration:>7.2f} {(len(rows) - errors) / elapsed:>7.2f} "
+                + ' '.join(f"{np.percentile(latencies, p):>7.3f}" for p in PERCENTILES)
+                + f" {latencies.max():>7.3f} {np.percentile([s[3] for s in rows], 95):>8.3f}"
+            )
+
+        passed = True
+        latencies = np.array([s[2] for s in samples])
+        error_rate = sum(1 for s in samples if not s[1]) / len(samples)
+        self.stdout.write("\nSLOs:")
+        for percentile, limit in sorted(slos.items()):
+            value = np.percentile(latencies, percentile)
+            ok = value <= limit
+            passed = passed and ok
+            self.stdout.write(f"  p{percentile:g} {value:.3f}s <= {limit:.3f}s: {'PASS' if ok else 'FAIL'}")
+        ok = error_rate <= max_error_rate
+        passed = passed and ok
+        self.stdout.write(f"  error rate {error_rate:.2%} <= {max_error_rate:.2%}: {'PASS' if ok else 'FAIL'}")
+        return passed
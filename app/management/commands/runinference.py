@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from app.inference import InferenceServer
+
+
+class Command(BaseCommand):
+    help = "Run the out-of-process inference service used when INFERENCE_SOCKET_PATH is set."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SOCKET_PATH,
+                            help="Unix domain socket path to listen on.")
+        parser.add_argument('--workers', type=int, default=settings.INFERENCE_WORKERS,
+                            help="Number of inference processes, each holding one model copy.")
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            self.stderr.write("No socket path given. Set INFERENCE_SOCKET_PATH or pass --socket.")
+            return
+        InferenceServer(options['socket'], options['workers']).serve_forever()
@@ -0,0 +1,185 @@
+"""Lightweight counters, gauges and histograms kept in the ``metrics`` cache.
+
+The ``metrics`` cache is file-based by default so that every gunicorn worker,
+and the inference service, reports into the same numbers. Increments are
+serialized with a file lock because the file backend's ``incr`` is a plain
+read-modify-write; batch() groups a request's increments under one lock.
+
+Recording a metric never raises: a failing metrics store is logged and
+otherwise ignored so that it can't turn a successful prediction into an error.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from filelock import FileLock
+
+METRICS_CACHE = 'metrics'
+NAMES_KEY = 'metrics:names'
+# Seconds before a process checks again that its metric names are still registered
+REGISTRY_RECHECK_INTERVAL = 60
+# Upper bounds in seconds, reaching the longest scheduler deadline; the last
+# bucket catches everything slower
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+                   300.0, 600.0, float('inf'))
+
+_checked_names = {}
+_lock = None
+_batch = threading.local()
+
+
+def _cache():
+    return caches[METRICS_CACHE]
+
+
+def _file_lock():
+    global _lock
+    if _lock is None:
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _lock = FileLock(os.path.join(settings.METRICS_DIR, 'metrics.lock'))
+    return _lock
+
+
+def _register(name, kind):
+    """Remember a metric name so that snapshot() can find it later.
+
+    The registry is re-checked periodically rather than trusted forever, so a
+    name lost to a concurrent update or a culled registry key comes back.
+    """
+    now = time.monotonic()
+    if now - _checked_names.get(name, float('-inf')) < REGISTRY_RECHECK_INTERVAL:
+        return
+    with _file_lock():
+        names = _cache().get(NAMES_KEY) or {}
+        if names.get(name) != kind:
+            names[name] = kind
+            _cache().set(NAMES_KEY, names, None)
+    _checked_names[name] = now
+
+
+def _safely(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            # Metrics must never break a prediction
+            print(f"Error recording metric: {e}")
+    return wrapper
+
+
+def _apply(amounts):
+    if not amounts:
+        return
+    metrics_cache = _cache()
+    with _file_lock():
+        for key, amount in amounts.items():
+            try:
+                metrics_cache.incr(key, amount)
+            except ValueError:
+                # Key does not exist yet
+                metrics_cache.set(key, amount, None)
+
+
+def _incr(amounts):
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending.update(amounts)
+    else:
+        _apply(amounts)
+
+
+@contextmanager
+def batch():
+    """Buffer this thread's counter and histogram updates and write them under one lock."""
+    if getattr(_batch, 'pending', None) is not None:
+        # Already batching further up the stack
+        yield
+        return
+    _batch.pending = Counter()
+    try:
+        yield
+    finally:
+        pending, _batch.pending = _batch.pending, None
+        _safely(_apply)(pending)
+
+
+@_safely
+def incr(name, amount=1):
+    """Increment a counter."""
+    _register(name, 'counter')
+    _incr({f'metrics:{name}': amount})
+
+
+@_safely
+def set_gauge(name, value):
+    """Record the current value of a gauge."""
+    _register(name, 'gauge')
+    _cache().set(f'metrics:{name}', value, None)
+
+
+@_safely
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """Record one observation in a histogram."""
+    _register(name, 'histogram')
+    index = bisect.bisect_left(buckets, value)
+    _incr({
+        f'metrics:{name}:count': 1,
+        # Sums are stored in microseconds so integer-only cache backends work
+        f'metrics:{name}:sum_us': int(value * 1_000_000),
+        f'metrics:{name}:bucket:{index}': 1,
+    })
+
+
+def histogram_percentile(bucket_counts, percentile, buckets=LATENCY_BUCKETS):
+    """Estimate a percentile as the upper bound of the bucket that contains it.
+
+    Returns None when the percentile falls in the unbounded last bucket, since
+    infinity has no JSON representation; snapshot() reports that bucket's count
+    as ``overflow``.
+    """
+    total = sum(bucket_counts)
+    if total == 0:
+        return None
+    target = total * percentile / 100
+    running = 0
+    for upper, count in zip(buckets, bucket_counts):
+        running += count
+        if running >= target:
+            return upper if upper != float('inf') else None
+    return None
+
+
+def snapshot():
+    """Return all known metrics as a JSON-serializable dictionary."""
+    metrics_cache = _cache()
+    names = metrics_cache.get(NAMES_KEY) or {}
+    data = {'counters': {}, 'gauges': {}, 'histograms': {}}
+
+    for name, kind in sorted(names.items()):
+        if kind == 'counter':
+            data['counters'][name] = metrics_cache.get(f'metrics:{name}', 0)
+        elif kind == 'gauge':
+            data['gauges'][name] = metrics_cache.get(f'metrics:{name}')
+        else:
+            count = metrics_cache.get(f'metrics:{name}:count', 0)
+            total = metrics_cache.get(f'metrics:{name}:sum_us', 0) / 1_000_000
+            bucket_counts = [metrics_cache.get(f'metrics:{name}:bucket:{i}', 0)
+                             for i in range(len(LATENCY_BUCKETS))]
+            data['histograms'][name] = {
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else None,
+                'p50': histogram_percentile(bucket_counts, 50),
+                'p95': histogram_percentile(bucket_counts, 95),
+                'p99': histogram_percentile(bucket_counts, 99),
+                'overflow': bucket_counts[-1],
+            }
+
+    return data
@@ -0,0 +1,131 @@
+"""On-demand profiling of individual prediction requests.
+
+A background thread samples the request thread's Python stack at a fixed
+interval and the model's forward pass is wrapped in torch's profiler. Results
+are written to PROFILE_DIR in formats that speedscope and flamegraph.pl open
+directly:
+
+- ``<id>.python.collapsed.txt``: sampled Python stacks in collapsed format
+- ``<id>.torch.collapsed.txt``: torch operator stacks weighted by self CPU time
+- ``<id>.torch.trace.json``: torch Chrome trace
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+
+
+class SamplingProfiler:
+    """Sample one thread's Python stack from a background thread."""
+
+    def __init__(self, thread_id=None, interval=None):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval or settings.PROFILE_SAMPLE_INTERVAL
+        self.samples = Counter()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})".replace(';', ':'))
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Return the samples in collapsed-stack format."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RequestProfiler:
+    """Profile one request and save the results to PROFILE_DIR."""
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.PROFILE_DIR
+        self.profile_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.sampler = SamplingProfiler()
+        self.torch_profile = None
+        self.started = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Error saving profile {self.profile_id}: {e}")
+        return False
+
+    @contextmanager
+    def profile_torch(self):
+        """Run the wrapped block (the forward pass) under torch's profiler."""
+        import torch
+
+        # export_stacks() writes an empty file on torch 2.0 unless the verbose
+        # experimental config is enabled alongside with_stack
+        with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                    with_stack=True,
+                                    experimental_config=torch._C._profiler._ExperimentalConfig(verbose=True)) as prof:
+            yield
+        self.torch_profile = prof
+
+    def save(self):
+        """Write the collected profiles and return their file names."""
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+
+        name = f"{self.profile_id}.python.collapsed.txt"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(self.sampler.collapsed())
+        files.append(name)
+
+        if self.torch_profile is not None:
+            name = f"{self.profile_id}.torch.collapsed.txt"
+            stacks_path = os.path.join(self.directory, name)
+            self.torch_profile.export_stacks(stacks_path, 'self_cpu_time_total')
+            if os.path.getsize(stacks_path) > 0:
+                files.append(name)
+            else:
+                print(f"torch profiler exported no stacks for profile {self.profile_id}")
+                os.remove(stacks_path)
+
+            name = f"{self.profile_id}.torch.trace.json"
+            self.torch_profile.export_chrome_trace(os.path.join(self.directory, name))
+            files.append(name)
+
+        print(f"Saved profile {self.profile_id} ({self.elapsed:.2f}s): {', '.join(files)}")
+        return files
+
+
+def profiling_requested(request):
+    """Return True when a staff user asked for this request to be profiled."""
+    if not settings.PROFILING_ENABLED:
+        return False
+    asked = request.headers.get('X-Profile') == '1' or request.GET.get('profile') == '1'
+    return asked and request.user.is_active and request.user.is_staff
@@ -0,0 +1,179 @@
+"""Priority-aware scheduling in front of model inference.
+
+Requests belong to one of the PRIORITY_CLASSES. Waiting requests are served in
+weighted fair queueing order: each one gets a virtual finish tag that advances
+by ``1 / weight`` of its class, and the smallest tag runs next. This keeps a
+large bulk upload from starving interactive photos while still letting bulk
+work progress. Each class can also be capped at a number of concurrent slots,
+and requests are dropped once their deadline passes or their client has gone.
+
+The inference service runs one scheduler for all web workers. Without it,
+get_scheduler() returns a per-process scheduler that can only order requests
+handled concurrently by the same process, i.e. under threaded gunicorn workers.
+"""
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from . import metrics
+
+PRIORITY_CLASSES = ('interactive', 'bulk', 'background')
+DEFAULT_PRIORITY = 'interactive'
+CANCEL_POLL_INTERVAL = 0.25  # Seconds between client disconnect checks while queued
+
+
+class RequestCancelled(Exception):
+    """Raised when a queued request passes its deadline or its client disconnects."""
+
+
+class _Ticket:
+    __slots__ = ('priority', 'tag', 'granted')
+
+    def __init__(self, priority, tag):
+        self.priority = priority
+        self.tag = tag
+        self.granted = False
+
+
+class InferenceScheduler:
+    """Hand out a fixed number of inference slots by weighted fair queueing."""
+
+    def __init__(self, concurrency=None, weights=None, limits=None, record_metrics=True):
+        self.concurrency = concurrency or settings.INFERENCE_CONCURRENCY
+        self.weights = weights or settings.SCHEDULER_WEIGHTS
+        limits = limits or settings.SCHEDULER_CLASS_LIMITS
+        # A limit of 0 means the class may use every slot
+        self.limits = {cls: limits.get(cls) or self.concurrency for cls in PRIORITY_CLASSES}
+        # The inference service reports queue time back to the web worker instead
+        self.record_metrics = record_metrics
+
+        self.condition = threading.Condition()
+        self.queues = {cls: deque() for cls in PRIORITY_CLASSES}
+        self.running = {cls: 0 for cls in PRIORITY_CLASSES}
+        self.total_running = 0
+        self.virtual_time = 0.0
+        self.last_tag = {cls: 0.0 for cls in PRIORITY_CLASSES}
+
+    @contextmanager
+    def slot(self, priority=DEFAULT_PRIORITY, deadline=None, is_cancelled=None):
+        """Wait for an inference slot and hold it for the duration of the block.
+
+        ``deadline`` is a ``time.monotonic()`` value; ``is_cancelled`` is polled
+        while waiting and should return True once the client has gone away.
+        Raises RequestCancelled if either fires before a slot is granted.
+        Yields the number of seconds spent waiting for the slot.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        queued = self._acquire(priority, deadline, is_cancelled)
+        try:
+            yield queued
+        finally:
+            with self.condition:
+                self.running[priority] -= 1
+                self.total_running -= 1
+                self._dispatch()
+
+    def _acquire(self, priority, deadline, is_cancelled):
+        enqueued = time.monotonic()
+        with self.condition:
+            tag = max(self.virtual_time, self.last_tag[priority]) + 1.0 / self.weights[priority]
+            self.last_tag[priority] = tag
+            ticket = _Ticket(priority, tag)
+            self.queues[priority].append(ticket)
+            self._dispatch()
+
+            while not ticket.granted:
+                reason = None
+                if deadline is not None and time.monotonic() >= deadline:
+                    reason = "deadline exceeded"
+                elif is_cancelled is not None and is_cancelled():
+                    reason = "client disconnected"
+                if reason:
+                    self.queues[priority].remove(ticket)
+                    if self.record_metrics:
+                        metrics.incr(f'scheduler.dropped.{priority}')
+                    raise RequestCancelled(f"Request dropped from the {priority} queue: {reason}")
+
+                timeout = CANCEL_POLL_INTERVAL
+                if deadline is not None:
+                    timeout = min(timeout, max(deadline - time.monotonic(), 0))
+                self.condition.wait(timeout)
+
+        queued = time.monotonic() - enqueued
+        if self.record_metrics:
+            metrics.observe(f'scheduler.queue_seconds.{priority}', queued)
+        return queued
+
+    def _dispatch(self):
+        """Grant free slots to the waiting tickets with the smallest tags."""
+        while self.total_running < self.concurrency:
+            candidates = [queue[0] for cls, queue in self.queues.items()
+                          if queue and self.running[cls] < self.limits[cls]]
+            if not candidates:
+                break
+            ticket = min(candidates, key=lambda t: t.tag)
+            self.queues[ticket.priority].popleft()
+            ticket.granted = True
+            self.running[ticket.priority] += 1
+            self.total_running += 1
+            self.virtual_time = ticket.tag
+            self.condition.notify_all()
+
+
+_current_request = ContextVar('inference_request', default=(DEFAULT_PRIORITY, None, None))
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide inference scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+    return _scheduler
+
+
+@contextmanager
+def request_schedule(priority=DEFAULT_PRIORITY, deadline=None, is_cancelled=None):
+    """Set the priority, deadline and cancellation check used by inference in this block."""
+    token = _current_request.set((priority, deadline, is_cancelled))
+    try:
+        yield
+    finally:
+        _current_request.reset(token)
+
+
+def current_schedule():
+    """Return ``(priority, deadline, is_cancelled)`` for the request being handled."""
+    return _current_request.get()
+
+
+def request_priority(request):
+    """Return the priority class a web request asked for, defaulting to interactive."""
+    priority = request.headers.get('X-Request-Priority') or request.POST.get('priority', '')
+    priority = priority.strip().lower()
+    return priority if priority in PRIORITY_CLASSES else DEFAULT_PRIORITY
+
+
+def socket_closed(sock):
+    """Return True if the peer of ``sock`` has closed the connection."""
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+def client_disconnected(request):
+    """Return True if the HTTP client has gone away (only detectable under gunicorn)."""
+    sock = request.META.get('gunicorn.socket')
+    return sock is not None and socket_closed(sock)
@@ -4,6 +4,7 @@ import numpy as np
 import uuid
 import tempfile
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from ultralytics import YOLO
 from PIL import Image
 import io
@@ -13,7 +14,14 @@ from pathlib import Path
 import torch
 import gc
 import hashlib
+import json
+import random
+import threading
 from django.core.cache import cache
+from filelock import FileLock, Timeout
+
+from . import metrics
+from .scheduling import CANCEL_POLL_INTERVAL, PRIORITY_CLASSES, RequestCancelled, current_schedule, get_scheduler
 
 # Constants
 CONFIDENCE_THRESHOLD = 0.1
@@ -26,6 +34,30 @@ COLORS = {
     'Infected Leaf': (255, 165, 0)  # Orange
 }
 MAX_IMAGE_SIZE = 640  # Maximum dimension for input images
+LOCK_FILE_MAX_AGE = 3600  # Seconds before an idle single-flight lock file is removed
+FLIGHT_CLEANUP_INTERVAL = 60  # Seconds between sweeps of published single-flight results
+
+_model_versions = {}
+
+
+def get_model_version(model_path):
+    """Return a short content hash of the weights file, used to version cache keys.
+
+    The hash is only recomputed when the file's modification time or size changes.
+    """
+    stat = os.stat(model_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _model_versions.get(model_path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    version = digest.hexdigest()[:12]
+    _model_versions[model_path] = (signature, version)
+    return version
 
 class LeafDiseaseDetector:
     """Service for detecting mangosteen leaf diseases using YOLOv8."""
@@ -35,57 +67,171 @@ class LeafDiseaseDetector:
         """Singleton pattern to avoid loading the model multiple times."""
         if cls._instance is None:
             cls._instance = super(LeafDiseaseDetector, cls).__new__(cls)
-            cls._instance.model = None
+            # The model and its version are swapped together as one tuple
+            cls._instance._active = (None, None)
+            cls._instance._reload_lock = threading.Lock()
+            cls._instance._failed_version = None
+            cls._instance._watcher = None
+            cls._instance.shadow_model = None
+            cls._instance._last_flight_cleanup = 0
+            cls._instance._shadow_slot = threading.Semaphore(1)
             cls._instance.temp_dir = tempfile.mkdtemp(prefix="leaf_disease_")
+            # Published results are read back from here, so the directory
+            # must not be writable by other local users
+            os.makedirs(settings.SINGLE_FLIGHT_DIR, mode=0o700, exist_ok=True)
+            if os.stat(settings.SINGLE_FLIGHT_DIR).st_uid != os.getuid():
+                raise ImproperlyConfigured(
+                    f"SINGLE_FLIGHT_DIR {settings.SINGLE_FLIGHT_DIR} is owned by another user")
             # Create a cleanup method to remove old files
             cls._instance.cleanup_old_files()
         return cls._instance
     
+    @property
+    def model(self):
+        return self._active[0]
+    
+    @property
+    def model_version(self):
+        return self._active[1]
+    
     def load_model(self):
         """Load the YOLOv8 model."""
         if self.model is None:
-            # Force garbage collection before loading model
-            gc.collect()
-            torch.cuda.empty_cache() if torch.cuda.is_available() else None
+            with self._reload_lock:
+                if self.model is None:
+                    # Force garbage collection before loading model
+                    gc.collect()
+                    torch.cuda.empty_cache() if torch.cuda.is_available() else None
+                    
+                    model_path = settings.MODEL_PATH
+                    if not os.path.exists(model_path):
+                        raise FileNotFoundError(f"Model file not found at {model_path}")
+                    
+                    version = get_model_version(model_path)
+                    self._active = (self._build_model(model_path), version)
+                    metrics.set_gauge('model.version', version)
+                    
+                    if settings.MODEL_SHADOW_PATH:
+                        self.shadow_model = self._build_model(settings.MODEL_SHADOW_PATH)
+                    self._start_model_watcher()
+        
+        return self.model
+    
+    def _build_model(self, model_path):
+        """Load and optimize a YOLOv8 model without installing it."""
+        try:
+            # Load model with task-specific parameters to reduce memory
+            model = YOLO(model_path, task='detect')
             
-            model_path = settings.MODEL_PATH
-            if not os.path.exists(model_path):
-                raise FileNotFoundError(f"Model file not found at {model_path}")
+            # Set model to evaluation mode and optimize for inference
+            if hasattr(model, 'model') and hasattr(model.model, 'eval'):
+                model.model.eval()
             
-            try:
-                # Load model with task-specific parameters to reduce memory
-                self.model = YOLO(model_path, task='detect')
-                
-                # Set model to evaluation mode and optimize for inference
-                if hasattr(self.model, 'model') and hasattr(self.model.model, 'eval'):
-                    self.model.model.eval()
-                
-                # Always apply quantization to reduce memory usage by ~75%
-                if hasattr(self.model, 'model'):
-                    # Apply int8 quantization - reduces memory usage significantly
-                    try:
-                        self.model.model = torch.quantization.quantize_dynamic(
-                            self.model.model, {torch.nn.Linear, torch.nn.Conv2d}, dtype=torch.qint8
-                        )
-                        print("Model successfully quantized to int8")
-                    except Exception as qe:
-                        print(f"Quantization failed: {qe}, falling back to half precision")
-                        # If quantization fails, try half precision as fallback
-                        if torch.cuda.is_available() and hasattr(self.model.model, 'half'):
-                            self.model.model.half()
-                            print("Model converted to half precision")
-                
-                print(f"Model loaded successfully from {model_path}")
-            except Exception as e:
-                print(f"Error loading model: {e}")
-                # Fallback to loading with weights_only=True
+            # Always apply quantization to reduce memory usage by ~75%
+            if hasattr(model, 'model'):
+                # Apply int8 quantization - reduces memory usage significantly
                 try:
-                    self.model = YOLO(model_path, task='detect')
-                    print("Model loaded with fallback method")
-                except Exception as fallback_error:
-                    raise RuntimeError(f"Failed to load model: {fallback_error}")
+                    model.model = torch.quantization.quantize_dynamic(
+                        model.model, {torch.nn.Linear, torch.nn.Conv2d}, dtype=torch.qint8
+                    )
+                    print("Model successfully quantized to int8")
+                except Exception as qe:
+                    print(f"Quantization failed: {qe}, falling back to half precision")
+                    # If quantization fails, try half precision as fallback
+                    if torch.cuda.is_available() and hasattr(model.model, 'half'):
+                        model.model.half()
+                        print("Model converted to half precision")
+            
+            print(f"Model loaded successfully from {model_path}")
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            # Fallback to loading with weights_only=True
+            try:
+                model = YOLO(model_path, task='detect')
+                print("Model loaded with fallback method")
+            except Exception as fallback_error:
+                raise RuntimeError(f"Failed to load model: {fallback_error}")
         
-        return self.model
+        return model
+    
+    def _warm_up(self, model):
+        """Run dummy inferences so a new model is fast on its first real request."""
+        sizes = {MAX_IMAGE_SIZE}
+        if settings.ADAPTIVE_RESOLUTION:
+            sizes.update(settings.ADAPTIVE_RESOLUTION_TIERS)
+        for size in sorted(sizes, reverse=True):
+            blank = np.zeros((size, size, 3), dtype=np.uint8)
+            for _ in range(settings.MODEL_WARMUP_RUNS):
+                self._predict(model, blank, size)
+    
+    def reload_model(self):
+        """Load, optimize and warm up the weights at MODEL_PATH, then swap them in.
+        
+        Requests already running finish on the model they started with; new
+        requests use the new one. Returns True if a new model was swapped in.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            print("Model reload already in progress")
+            return False
+        
+        version = None
+        try:
+            model_path = settings.MODEL_PATH
+            version = get_model_version(model_path)
+            if version == self.model_version:
+                return False
+            
+            start_time = time.time()
+            model = self._build_model(model_path)
+            self._warm_up(model)
+            
+            previous_version = self.model_version
+            self._active = (model, version)
+            print(f"Swapped model {previous_version} for {version} in {time.time() - start_time:.2f} seconds")
+            metrics.incr('model.reloads')
+            metrics.set_gauge('model.version', version)
+            
+            gc.collect()
+            return True
+        except Exception as e:
+            print(f"Model reload failed, keeping version {self.model_version}: {e}")
+            self._failed_version = version
+            metrics.incr('model.reload_failures')
+            return False
+        finally:
+            self._reload_lock.release()
+    
+    def reload_model_async(self):
+        """Reload the model in a background thread."""
+        threading.Thread(target=self.reload_model, daemon=True).start()
+    
+    def _start_model_watcher(self):
+        if settings.MODEL_WATCH_INTERVAL <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch_model, daemon=True)
+        self._watcher.start()
+    
+    def _watch_model(self):
+        """Reload the model whenever the weights at MODEL_PATH change."""
+        while True:
+            time.sleep(settings.MODEL_WATCH_INTERVAL)
+            try:
+                version = get_model_version(settings.MODEL_PATH)
+            except OSError:
+                # The file is being replaced; try again on the next tick
+                continue
+            if version not in (self.model_version, self._failed_version):
+                self.reload_model()
+    
+    def current_model_version(self):
+        """Return the version of the model that will serve a new request."""
+        if settings.INFERENCE_SOCKET_PATH:
+            from .inference import served_model_version
+            # The weights on disk run ahead of the workers while they reload,
+            # and for good if they fail to load them, so key by what they serve
+            return served_model_version() or get_model_version(settings.MODEL_PATH)
+        self.load_model()
+        return self.model_version
     
     def cleanup_old_files(self):
         """Clean up temporary files older than 5 minutes."""
@@ -96,6 +242,25 @@ class LeafDiseaseDetector:
                     os.remove(file_path)
                 except Exception as e:
                     print(f"Error cleaning up {file_path}: {e}")
+        
+        self.cleanup_single_flight_files()
+    
+    def cleanup_single_flight_files(self):
+        """Remove old single-flight lock files and published results."""
+        current_time = time.time()
+        self._last_flight_cleanup = current_time
+        # Lock files are shared between workers, so keep them well past any
+        # lock timeout; results only need to outlive the followers waiting on them
+        for pattern, max_age in (("*.lock", LOCK_FILE_MAX_AGE),
+                                 ("*.waiting", LOCK_FILE_MAX_AGE),
+                                 ("*.leader", LOCK_FILE_MAX_AGE),
+                                 ("*.npz", settings.SINGLE_FLIGHT_RESULT_MAX_AGE)):
+            for file_path in Path(settings.SINGLE_FLIGHT_DIR).glob(pattern):
+                try:
+                    if current_time - file_path.stat().st_mtime > max_age:
+                        os.remove(file_path)
+                except Exception as e:
+                    print(f"Error cleaning up {file_path}: {e}")
     
     def save_uploaded_image(self, uploaded_file):
         """Save an uploaded image to a temporary location and return the path."""
@@ -117,7 +282,7 @@ class LeafDiseaseDetector:
             image_data = f.read()
         return hashlib.md5(image_data).hexdigest()
     
-    def preprocess_image(self, image_path):
+    def preprocess_image(self, image_path, max_size=MAX_IMAGE_SIZE):
         """Enhanced preprocessing for better performance and accuracy."""
         # Read image
         img = cv2.imread(image_path)
@@ -127,13 +292,13 @@ class LeafDiseaseDetector:
         height, width = img.shape[:2]
         
         # Step 1: Resize the image to a reasonable size
-        if max(width, height) > MAX_IMAGE_SIZE:
+        if max(width, height) > max_size:
             if width > height:
-                new_width = MAX_IMAGE_SIZE
-                new_height = int(height * (MAX_IMAGE_SIZE / width))
+                new_width = max_size
+                new_height = int(height * (max_size / width))
             else:
-                new_height = MAX_IMAGE_SIZE
-                new_width = int(width * (MAX_IMAGE_SIZE / height))
+                new_height = max_size
+                new_width = int(width * (max_size / height))
             img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
         
         # Step 2: Apply basic image enhancement
@@ -154,35 +319,44 @@ class LeafDiseaseDetector:
         enhanced_img = cv2.GaussianBlur(enhanced_img, (3, 3), 0)
         
         # Save the enhanced image
-        preprocessed_path = os.path.join(self.temp_dir, f"preprocessed_{os.path.basename(image_path)}")
+        preprocessed_path = os.path.join(self.temp_dir, f"preprocessed_{max_size}_{os.path.basename(image_path)}")
         cv2.imwrite(preprocessed_path, enhanced_img)
         
         return preprocessed_path
     
-    def predict_image(self, image_path):
-        """Make predictions on a single image with caching."""
-        # Check if we have a cached result for this image
-        image_hash = self.get_image_hash(image_path)
-        cache_key = f"leaf_disease_prediction_{image_hash}"
-        
-        cached_result = cache.get(cache_key)
-        if cached_result:
-            print("Using cached prediction result")
-            return cached_result['img'], cached_result['results']
-        
+    def detect(self, img, imgsz=MAX_IMAGE_SIZE):
+        """Run the model on a preprocessed BGR image and return raw detections.
+
+        Each detection is a ``(x1, y1, x2, y2, confidence, class_name)`` tuple of
+        plain Python values so it can be sent across the inference socket.
+        """
+        return self.detect_with_version(img, imgsz)[0]
+
+    def detect_with_version(self, img, imgsz=MAX_IMAGE_SIZE):
+        """Like detect(), but also return the version of the model that was used."""
         # Ensure model is loaded
         if self.model is None:
             self.load_model()
-        
-        # Preprocess the image for better detection
-        preprocessed_image_path = self.preprocess_image(image_path)
-            
-        # Load the image for drawing results
-        img = cv2.imread(preprocessed_image_path)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-        predictions = self.model.predict(
-            source=preprocessed_image_path,
+        # Take one snapshot so a concurrent hot-swap can't change the model mid-request
+        model, version = self._active
+
+        start_time = time.perf_counter()
+        detections = self._predict(model, img, imgsz)
+        elapsed = time.perf_counter() - start_time
+
+        # Compare a sample of traffic against the shadow model, one at a time
+        if (self.shadow_model is not None and random.random() < settings.MODEL_SHADOW_SAMPLE_RATE
+                and self._shadow_slot.acquire(blocking=False)):
+            threading.Thread(target=self._run_shadow, args=(img, imgsz, detections, elapsed),
+                             daemon=True).start()
+
+        return detections, version
+
+    def _predict(self, model, img, imgsz):
+        predictions = model.predict(
+            source=img,
+            imgsz=imgsz,
             conf=CONFIDENCE_THRESHOLD,
             iou=IOU_THRESHOLD,
             max_det=MAX_DETECTIONS,
@@ -190,25 +364,269 @@ class LeafDiseaseDetector:
             verbose=False
         )[0]
 
+        detections = []
+        for box in predictions.boxes:
+            cls = int(box.cls[0].cpu().numpy())
+            conf = float(box.conf[0].cpu().numpy())
+            x1, y1, x2, y2 = (float(v) for v in box.xyxy[0].cpu().numpy())
+            detections.append((x1, y1, x2, y2, conf, predictions.names[cls]))
+        return detections
+
+    def _run_shadow(self, img, imgsz, primary_detections, primary_seconds):
+        """Run the shadow model on a request and record how it compares."""
+        try:
+            start_time = time.perf_counter()
+            shadow_detections = self._predict(self.shadow_model, img, imgsz)
+            shadow_seconds = time.perf_counter() - start_time
+
+            metrics.incr('shadow.samples')
+            metrics.observe('shadow.primary_seconds', primary_seconds)
+            metrics.observe('shadow.candidate_seconds', shadow_seconds)
+
+            primary_verdict = self._raw_verdict(primary_detections)
+            shadow_verdict = self._raw_verdict(shadow_detections)
+            if primary_verdict != shadow_verdict:
+                metrics.incr('shadow.verdict_mismatches')
+                print(f"Shadow model verdict {shadow_verdict} differs from primary {primary_verdict}")
+        except Exception as e:
+            print(f"Shadow inference failed: {e}")
+        finally:
+            self._shadow_slot.release()
+
+    def _raw_verdict(self, detections):
+        """Summarize unfiltered detections as a leaf status for shadow comparison."""
+        class_names = {detection[5] for detection in detections}
+        if class_names & {'Infected Leaf', 'Disease Part'}:
+            return "Infected"
+        if 'Healthy' in class_names:
+            return "Healthy"
+        return "No Detected Leaf"
+
+    def run_inference(self, img, imgsz=MAX_IMAGE_SIZE, profiler=None):
+        """Run detection locally or on the inference service when one is configured.
+
+        Returns the detections and the version of the model that produced them.
+        """
+        priority, deadline, is_cancelled = current_schedule()
+        if settings.INFERENCE_SOCKET_PATH:
+            # The forward pass, and its scheduling, happen in the inference
+            # service, so a profiler only sees this process waiting on the socket
+            from .inference import InferenceClient
+            return InferenceClient().detect(img, imgsz=imgsz, priority=priority, deadline=deadline,
+                                            is_cancelled=is_cancelled)
+        with get_scheduler().slot(priority, deadline, is_cancelled):
+            if profiler is not None:
+                with profiler.profile_torch():
+                    return self.detect_with_version(img, imgsz=imgsz)
+            return self.detect_with_version(img, imgsz=imgsz)
+
+    def predict_image(self, image_path, resolution=MAX_IMAGE_SIZE):
+        """Make predictions on a single image with caching.
+
+        ``resolution`` is the maximum input dimension used for inference; the
+        adaptive load shedder lowers it when the server is under pressure.
+        """
+        img, results, _ = self.predict_image_with_resolution(image_path, resolution)
+        return img, results
+
+    def predict_image_with_resolution(self, image_path, resolution=MAX_IMAGE_SIZE):
+        """Like predict_image(), but also return the resolution of the result.
+
+        A cached result from a higher resolution tier is reused instead of
+        computing a degraded one, so the returned resolution may be higher
+        than the one requested.
+        """
+        # Check if we have a cached result for this image and model at this or a higher resolution
+        image_hash = self.get_image_hash(image_path)
+        model_version = self.current_model_version()
+        cache_key = self._cache_key(image_hash, model_version, resolution)
+        
+        cached_result = self._get_cached(image_hash, model_version, resolution)
+        if cached_result:
+            print("Using cached prediction result")
+            return cached_result['img'], cached_result['results'], cached_result['resolution']
+        
+        # Coalesce identical concurrent requests: the first one computes the
+        # result while duplicates wait on the lock and then read it from cache
+        lock = FileLock(os.path.join(settings.SINGLE_FLIGHT_DIR, f"{cache_key}.lock"),
+                        timeout=settings.SINGLE_FLIGHT_TIMEOUT)
+        if not self._acquire_flight_lock(lock, cache_key):
+            return self._compute_and_cache(image_hash, image_path, resolution, cache_key)
+
+        try:
+            # The leader may be in another worker with its own cache, so
+            # also look for the result it published next to the lock
+            cached_result = (self._get_cached(image_hash, model_version, resolution)
+                             or self._read_flight_result(cache_key, image_hash))
+            if cached_result:
+                print("Using coalesced prediction result")
+                metrics.incr('predictions.coalesced')
+                return cached_result['img'], cached_result['results'], cached_result['resolution']
+            return self._compute_and_cache(image_hash, image_path, resolution, cache_key)
+        finally:
+            lock.release()
+
+    def _acquire_flight_lock(self, lock, cache_key):
+        """Take the single-flight lock, flagging contention so the leader publishes its result.
+
+        The wait follows the request's schedule: it ends at the request's
+        deadline, raises RequestCancelled if the client disconnects, and is
+        skipped when the leader has a lower priority class, since the leader may
+        be queued behind other work. Returns False when the caller should
+        compute the result itself instead.
+        """
+        priority, deadline, is_cancelled = current_schedule()
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            if self._outranks_flight_leader(priority, cache_key):
+                metrics.incr('predictions.single_flight_bypassed')
+                return False
+
+            Path(self._flight_waiting_path(cache_key)).touch()
+            give_up = time.monotonic() + settings.SINGLE_FLIGHT_TIMEOUT
+            if deadline is not None:
+                give_up = min(give_up, deadline)
+            while True:
+                remaining = give_up - time.monotonic()
+                if remaining <= 0:
+                    # Don't let a stuck leader block followers forever
+                    print(f"Timed out waiting for in-flight prediction {cache_key}, computing directly")
+                    metrics.incr('predictions.single_flight_timeouts')
+                    return False
+                try:
+                    lock.acquire(timeout=min(CANCEL_POLL_INTERVAL, remaining))
+                    break
+                except Timeout:
+                    if is_cancelled is not None and is_cancelled():
+                        raise RequestCancelled("Request dropped while waiting for an identical prediction: "
+                                               "client disconnected")
+
+        try:
+            with open(self._flight_leader_path(cache_key), 'w') as f:
+                f.write(priority)
+        except OSError as e:
+            print(f"Error recording single-flight leader {cache_key}: {e}")
+        return True
+
+    def _outranks_flight_leader(self, priority, cache_key):
+        """Return True if ``priority`` is a higher class than the current leader's."""
+        try:
+            with open(self._flight_leader_path(cache_key)) as f:
+                leader_priority = f.read().strip()
+        except OSError:
+            return False
+        if leader_priority not in PRIORITY_CLASSES:
+            return False
+        return PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(leader_priority)
+
+    def _get_cached(self, image_hash, model_version, resolution):
+        """Return the cached result at ``resolution`` or, failing that, the nearest higher tier."""
+        resolutions = sorted({MAX_IMAGE_SIZE, *settings.ADAPTIVE_RESOLUTION_TIERS} - {resolution})
+        resolutions = [resolution] + [r for r in resolutions if r > resolution]
+        keys = [self._cache_key(image_hash, model_version, r) for r in resolutions]
+        found = cache.get_many(keys)
+        for key, r in zip(keys, resolutions):
+            if found.get(key):
+                return {'img': found[key]['img'], 'results': found[key]['results'], 'resolution': r}
+        return None
+
+    def _cache_key(self, image_hash, model_version, resolution):
+        return f"leaf_disease_prediction_{model_version}_{image_hash}_{resolution}"
+
+    def _compute_and_cache(self, image_hash, image_path, resolution, flight_key):
+        img, results, model_version = self._analyze(image_path, resolution)
+
+        # Save results to cache under the model that actually produced them, so
+        # a result computed during a hot-swap is never served for the new model
+        cache_key = self._cache_key(image_hash, model_version, resolution)
+        cache.set(cache_key, {'img': img, 'results': results})
+
+        # Publish the result for followers waiting in other worker processes.
+        # They wait on the lock for the key they looked up, which can name a
+        # different version than the one that answered, so publish under that.
+        if os.path.exists(self._flight_waiting_path(flight_key)):
+            self._publish_flight_result(flight_key, img, results, resolution, model_version)
+
+        return img, results, resolution
+
+    def _flight_result_path(self, cache_key):
+        return os.path.join(settings.SINGLE_FLIGHT_DIR, f"{cache_key}.npz")
+
+    def _flight_leader_path(self, cache_key):
+        return os.path.join(settings.SINGLE_FLIGHT_DIR, f"{cache_key}.leader")
+
+    def _flight_waiting_path(self, cache_key):
+        return os.path.join(settings.SINGLE_FLIGHT_DIR, f"{cache_key}.waiting")
+
+    def _publish_flight_result(self, cache_key, img, results, resolution, model_version):
+        """Write a result for followers in other workers as a plain array and JSON (no pickle)."""
+        path = self._flight_result_path(cache_key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, img=img, meta=np.array(json.dumps({'results': results, 'resolution': resolution,
+                                                      'model_version': model_version})))
+            # Rename so readers never see a partially written file
+            os.replace(tmp_path, path)
+            os.remove(self._flight_waiting_path(cache_key))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error publishing prediction result {cache_key}: {e}")
+        
+        if time.time() - self._last_flight_cleanup > FLIGHT_CLEANUP_INTERVAL:
+            self.cleanup_single_flight_files()
+
+    def _read_flight_result(self, cache_key, image_hash):
+        """Return a result published by a leader in any worker, or None."""
+        path = self._flight_result_path(cache_key)
+        try:
+            if time.time() - os.path.getmtime(path) > settings.SINGLE_FLIGHT_RESULT_MAX_AGE:
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                result = json.loads(str(data['meta']))
+                result['img'] = data['img']
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error reading prediction result {cache_key}: {e}")
+            return None
+        
+        # Keep a local copy so later duplicates in this worker skip the lock,
+        # again under the model that produced it
+        cache.set(self._cache_key(image_hash, result['model_version'], result['resolution']),
+                  {'img': result['img'], 'results': result['results']})
+        return result
+
+    def analyze_image(self, image_path, resolution=MAX_IMAGE_SIZE, profiler=None):
+        """Preprocess, run inference and annotate an image without using the cache."""
+        img, results, _ = self._analyze(image_path, resolution, profiler)
+        return img, results
+
+    def _analyze(self, image_path, resolution=MAX_IMAGE_SIZE, profiler=None):
+        # Preprocess the image for better detection
+        preprocessed_image_path = self.preprocess_image(image_path, max_size=resolution)
+            
+        # Load the image for inference and for drawing results
+        bgr_img = cv2.imread(preprocessed_image_path)
+        img = cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB)
+
+        detections, model_version = self.run_inference(bgr_img, imgsz=resolution, profiler=profiler)
+
         """Process predictions."""
         results = {cls: {'count': 0, 'confidences': [], 'avg_confidence': 0.0} for cls in CLASSES}
 
         # First, collect all Disease Part boxes
         disease_part_boxes = []
-        for box in predictions.boxes:
-            cls = int(box.cls[0].cpu().numpy())
-            class_name = predictions.names[cls]
+        for x1, y1, x2, y2, conf, class_name in detections:
             if class_name == 'Disease Part':
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
                 disease_part_boxes.append((x1, y1, x2, y2))
 
         # Then, collect all Infected Leaf boxes and filter them
         valid_infected_leaf_boxes = []
-        for box in predictions.boxes:
-            cls = int(box.cls[0].cpu().numpy())
-            class_name = predictions.names[cls]
+        for x1, y1, x2, y2, conf, class_name in detections:
             if class_name == 'Infected Leaf':
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
                 # Check if this infected leaf contains any disease parts
                 has_disease_part = False
                 for d_x1, d_y1, d_x2, d_y2 in disease_part_boxes:
@@ -222,17 +640,11 @@ class LeafDiseaseDetector:
                     valid_infected_leaf_boxes.append((x1, y1, x2, y2))
 
         # Process all detections
-        for box in predictions.boxes:
-            cls = int(box.cls[0].cpu().numpy())
-            conf = float(box.conf[0].cpu().numpy())
-            class_name = predictions.names[cls]
-
+        for x1, y1, x2, y2, conf, class_name in detections:
             # Apply stricter confidence threshold (0.6) to filter out low-confidence detections
             if conf < CONFIDENCE_THRESHOLD:
                 continue
 
-            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-
             # Skip Infected Leaf detections that don't contain Disease Parts
             if class_name == 'Infected Leaf':
                 box_coords = (x1, y1, x2, y2)
@@ -306,11 +718,8 @@ class LeafDiseaseDetector:
         for class_name in CLASSES:
             if results[class_name]['confidences']:
                 results[class_name]['avg_confidence'] = sum(results[class_name]['confidences']) / len(results[class_name]['confidences'])
-        
-        # Save results to cache - we'll only cache the outcome data, not the full image
-        cache.set(cache_key, {'img': img, 'results': results})
 
-        return img, results
+        return img, results, model_version
     
     def get_status(self, results):
         """Return the overall status of the leaf based on prediction results."""
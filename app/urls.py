@@ -6,4 +6,9 @@ urlpatterns = [
     path('predict/', views.predict, name='predict'),
     path('result/', views.result, name='result'),
     path('image/<str:image_type>/', views.serve_image, name='serve_image'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('analytics/rollups/', views.analytics_rollups, name='analytics_rollups'),
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:name>/', views.profile_download, name='profile_download'),
+    path('model/reload/', views.reload_model, name='reload_model'),
 ] 
\ No newline at end of file
@@ -1,6 +1,9 @@
 from django.shortcuts import render, redirect
-from django.http import JsonResponse, FileResponse
+from django.http import JsonResponse, FileResponse, Http404
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 from django.conf import settings
 import os
 import json
@@ -8,11 +11,17 @@ import uuid
 import time
 import base64
 import re
-from datetime import datetime
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 import gc
 import torch
 
-from .services import LeafDiseaseDetector
+from . import metrics
+from .analytics import log_prediction, query_rollups
+from .load_shedding import get_tracker, select_resolution
+from .profiling import RequestProfiler, profiling_requested
+from .scheduling import RequestCancelled, client_disconnected, request_priority, request_schedule
+from .services import LeafDiseaseDetector, MAX_IMAGE_SIZE
 
 def home(request):
     """Home page view with logo, navigation buttons, and about section."""
@@ -68,6 +77,13 @@ def predict(request):
                 'active_section': 'gallery'
             })
         
+        # Optional plot identifier used to group predictions in analytics
+        plot = request.POST.get('plot', '').strip()[:64]
+        
+        # Interactive uploads are served ahead of bulk and background traffic
+        priority = request_priority(request)
+        deadline = time.monotonic() + settings.SCHEDULER_DEADLINES[priority]
+        
         try:
             # Initialize detector
             detector = LeafDiseaseDetector()
@@ -121,12 +137,30 @@ def predict(request):
             # Start timer to measure processing time
             start_time = time.time()
             
-            # Make prediction
-            img, results = detector.predict_image(image_path)
+            # Profile this request when a staff user asked for it
+            profiler = RequestProfiler() if profiling_requested(request) else None
+            
+            with get_tracker().track(), (profiler or nullcontext()), \
+                    request_schedule(priority, deadline, lambda: client_disconnected(request)):
+                # Shed load by lowering the inference resolution when busy
+                resolution = select_resolution(MAX_IMAGE_SIZE)
+                
+                # Make prediction
+                if profiler is not None:
+                    # Bypass the cache so the profile shows the real work
+                    img, results = detector.analyze_image(image_path, resolution, profiler=profiler)
+                else:
+                    # A cached result from a higher tier may be served instead
+                    img, results, resolution = detector.predict_image_with_resolution(image_path, resolution)
             
             # Calculate processing time
             processing_time = time.time() - start_time
-            print(f"Image processing completed in {processing_time:.2f} seconds")
+            print(f"Image processing completed in {processing_time:.2f} seconds at {resolution}px")
+            with metrics.batch():
+                metrics.incr(f'predictions.resolution.{resolution}')
+                metrics.set_gauge('inference_resolution', resolution)
+                metrics.observe('prediction_seconds', processing_time)
+                metrics.observe(f'prediction_seconds.{priority}', processing_time)
             
             # Save result image and get base64 data
             result_path, result_base64 = detector.save_result_image(img, results)
@@ -148,12 +182,17 @@ def predict(request):
                 'healthy_confidence': results['Healthy']['avg_confidence'] * 100 if results['Healthy']['count'] > 0 else 0,
                 'infected_leaf_confidence': results['Infected Leaf']['avg_confidence'] * 100 if results['Infected Leaf']['count'] > 0 else 0,
                 'disease_part_confidence': results['Disease Part']['avg_confidence'] * 100 if results['Disease Part']['count'] > 0 else 0,
-                'processing_time': f"{processing_time:.2f}"
+                'processing_time': f"{processing_time:.2f}",
+                'resolution': resolution
             }
             
             # Store in session
             request.session['prediction_results'] = prediction_result
             
+            # Append the outcome to the analytics log
+            log_prediction(status, results, processing_time=processing_time, resolution=resolution,
+                           plot=plot, prediction_id=prediction_result['id'])
+            
             # Free references to large objects to help garbage collection
             img = None
             results = None
@@ -165,20 +204,41 @@ def predict(request):
             
             # Return JSON response for AJAX requests
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return JsonResponse({
+                response_data = {
                     'success': True,
                     'redirect_url': '/result/',
                     'status': status,
                     'healthy_count': prediction_result['healthy_count'],
                     'infected_leaf_count': prediction_result['infected_leaf_count'],
                     'disease_part_count': prediction_result['disease_part_count'],
-                    'processing_time': prediction_result['processing_time']
-                })
+                    'processing_time': prediction_result['processing_time'],
+                    'resolution': prediction_result['resolution']
+                }
+                if profiler is not None:
+                    response_data['profile_id'] = profiler.profile_id
+                return JsonResponse(response_data)
             
             # Redirect to result page for regular form submissions
             return redirect('result')
             
+        except RequestCancelled as e:
+            # The client is gone or has waited too long; don't spend inference on it
+            print(f"Prediction dropped: {e}")
+            log_prediction('Dropped', plot=plot)
+            if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+                return JsonResponse({
+                    'success': False,
+                    'error': str(e),
+                }, status=503)
+
+            return render(request, 'app/base.html', {
+                'error': f"The server is busy and could not process your image in time. Please try again. ({str(e)})",
+                'active_section': 'gallery'
+            })
+        
         except Exception as e:
+            metrics.incr('predictions.errors')
+            log_prediction('Error', plot=plot)
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return JsonResponse({
                     'success': False,
@@ -224,3 +284,68 @@ def serve_image(request, image_type):
         return redirect('home')
     
     return FileResponse(open(image_path, 'rb'))
+
+@staff_member_required
+def metrics_view(request):
+    """Return request metrics as JSON for staff users."""
+    return JsonResponse(metrics.snapshot())
+
+@staff_member_required
+def analytics_rollups(request):
+    """Return prediction rollups for a date range as JSON for staff users.
+
+    Query parameters: ``start`` and ``end`` (YYYY-MM-DD, default the last 7 days),
+    ``plot`` (optional) and ``granularity`` (``day`` or ``hour``).
+    """
+    try:
+        end = datetime.strptime(request.GET['end'], '%Y-%m-%d').date() if 'end' in request.GET else datetime.now().date()
+        start = datetime.strptime(request.GET['start'], '%Y-%m-%d').date() if 'start' in request.GET else end - timedelta(days=6)
+    except ValueError:
+        return JsonResponse({'error': "Dates must use the YYYY-MM-DD format."}, status=400)
+    
+    granularity = request.GET.get('granularity', 'day')
+    if granularity not in ('day', 'hour'):
+        return JsonResponse({'error': "Granularity must be 'day' or 'hour'."}, status=400)
+    
+    buckets = query_rollups(start, end, plot=request.GET.get('plot'), granularity=granularity)
+    return JsonResponse({'start': start.isoformat(), 'end': end.isoformat(), 'buckets': buckets})
+
+@staff_member_required
+def profile_list(request):
+    """List saved request profiles for staff users."""
+    profile_dir = settings.PROFILE_DIR
+    names = sorted(os.listdir(profile_dir), reverse=True) if os.path.isdir(profile_dir) else []
+    return JsonResponse({'profiles': [
+        {'name': name, 'url': reverse('profile_download', args=[name])} for name in names
+    ]})
+
+@staff_member_required
+def profile_download(request, name):
+    """Download a saved request profile."""
+    # Only serve plain file names from the profile directory
+    if not re.fullmatch(r'[\w.-]+', name):
+        raise Http404("Profile not found")
+    
+    profile_path = os.path.join(settings.PROFILE_DIR, name)
+    if not os.path.isfile(profile_path):
+        raise Http404("Profile not found")
+    
+    return FileResponse(open(profile_path, 'rb'), as_attachment=True, filename=name)
+
+@staff_member_required
+@require_POST
+def reload_model(request):
+    """Start loading the weights at MODEL_PATH in the background and swap them in when ready.
+
+    With the inference service the request is forwarded to every inference
+    worker. Otherwise only the web worker that served this request reloads;
+    the other workers pick up new weights only through their file watcher, so
+    MODEL_WATCH_INTERVAL must be enabled when running several workers.
+    """
+    detector = LeafDiseaseDetector()
+    if settings.INFERENCE_SOCKET_PATH:
+        from .inference import InferenceClient
+        InferenceClient().reload()
+    else:
+        detector.reload_model_async()
+    return JsonResponse({'reloading': True, 'model_version': detector.current_model_version()})
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
@@ -102,6 +103,9 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.file'  # Use file-based sessi
 SESSION_COOKIE_AGE = 3600  # 1 hour
 SESSION_SAVE_EVERY_REQUEST = False
 
+# Metrics settings
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'leaf_disease_metrics'))
+
 # Cache settings
 CACHES = {
     'default': {
@@ -112,6 +116,15 @@ CACHES = {
             'MAX_ENTRIES': 100,  # Limit cache entries
             'CULL_FREQUENCY': 2,  # Fraction of entries to cull when max is reached
         }
+    },
+    # Request metrics, shared by every worker process through the filesystem
+    'metrics': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(METRICS_DIR, 'cache'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        }
     }
 }
 
@@ -146,6 +159,78 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Model settings
 MODEL_PATH = os.path.join(BASE_DIR, 'model_weights', 'best.pt')
+# New weights written to MODEL_PATH are loaded, warmed up and swapped in without a restart
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', '30'))  # Seconds, 0 disables watching
+MODEL_WARMUP_RUNS = int(os.environ.get('MODEL_WARMUP_RUNS', '2'))
+# Optional candidate model that runs on a sample of traffic for comparison only
+MODEL_SHADOW_PATH = os.environ.get('MODEL_SHADOW_PATH', '')
+MODEL_SHADOW_SAMPLE_RATE = float(os.environ.get('MODEL_SHADOW_SAMPLE_RATE', '0.1'))
+
+# Inference service settings
+# When INFERENCE_SOCKET_PATH is set, web workers send preprocessed images to the
+# pool started with `manage.py runinference` instead of loading the model themselves.
+INFERENCE_SOCKET_PATH = os.environ.get('INFERENCE_SOCKET_PATH', '')
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', '2'))
+INFERENCE_TIMEOUT = float(os.environ.get('INFERENCE_TIMEOUT', '30'))  # Seconds per request
+INFERENCE_RETRIES = int(os.environ.get('INFERENCE_RETRIES', '2'))  # Resends only while the service can't be reached
+INFERENCE_TORCH_THREADS = int(os.environ.get('INFERENCE_TORCH_THREADS', '0'))  # 0 keeps torch's default
+
+# Scheduling settings
+# Inference slots are shared between the interactive, bulk and background priority
+# classes by weighted fair queueing. Clients pick a class with the
+# X-Request-Priority header or a `priority` form field; the default is interactive.
+# With INFERENCE_SOCKET_PATH set, the inference service queues requests from every
+# web worker in one scheduler, so priority applies across processes. Without it each
+# process only orders its own requests, which needs threaded gunicorn workers
+# (--worker-class gthread); a sync worker never has more than one request to order.
+INFERENCE_CONCURRENCY = int(os.environ.get('INFERENCE_CONCURRENCY', '1'))  # Slots per process
+SCHEDULER_WEIGHTS = {'interactive': 8, 'bulk': 2, 'background': 1}
+SCHEDULER_CLASS_LIMITS = {'interactive': 0, 'bulk': 1, 'background': 1}  # 0 means no limit
+SCHEDULER_DEADLINES = {'interactive': 30, 'bulk': 120, 'background': 600}  # Seconds before a queued request is dropped
+
+# Adaptive resolution settings
+# Under load the inference resolution steps down one tier each time the number of
+# in-flight requests reaches the next threshold, and steps back up once it falls
+# ADAPTIVE_RESOLUTION_HYSTERESIS below that threshold.
+ADAPTIVE_RESOLUTION = os.environ.get('ADAPTIVE_RESOLUTION', 'False') == 'True'
+ADAPTIVE_RESOLUTION_TIERS = [int(v) for v in os.environ.get('ADAPTIVE_RESOLUTION_TIERS', '640,512,416,320').split(',')]
+ADAPTIVE_RESOLUTION_THRESHOLDS = [int(v) for v in os.environ.get('ADAPTIVE_RESOLUTION_THRESHOLDS', '4,8,12').split(',')]
+ADAPTIVE_RESOLUTION_HYSTERESIS = int(os.environ.get('ADAPTIVE_RESOLUTION_HYSTERESIS', '2'))
+INFLIGHT_DIR = os.environ.get('INFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'leaf_disease_inflight'))
+# Live requests refresh their tickets every quarter of this, so it only needs to
+# outlast the refresh, not the longest SCHEDULER_DEADLINES entry
+INFLIGHT_STALE_SECONDS = int(os.environ.get('INFLIGHT_STALE_SECONDS', '120'))
+
+# Single-flight settings
+# Concurrent predictions of the same image wait on a file lock while the first one
+# computes. When another request is waiting, the leader publishes its result next
+# to the lock so followers in any worker can reuse it, even though each worker has
+# its own local-memory cache.
+# Results are read back from this directory, so it must be private to the app's user
+SINGLE_FLIGHT_DIR = os.environ.get('SINGLE_FLIGHT_DIR', os.path.join(BASE_DIR, 'single_flight'))
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT', '30'))  # Seconds to wait for the leader, at most until the request's deadline
+SINGLE_FLIGHT_RESULT_MAX_AGE = int(os.environ.get('SINGLE_FLIGHT_RESULT_MAX_AGE', '300'))  # Seconds a published result is reused
+
+# Load testing settings
+# Sample images uploaded by `manage.py loadtest`
+LOADTEST_CORPUS_DIR = os.environ.get('LOADTEST_CORPUS_DIR', os.path.join(BASE_DIR, 'loadtest_corpus'))
+
+# Prediction log settings
+# Prediction outcomes are buffered and written as date-partitioned Parquet files
+# with hourly rollups for the /analytics/rollups/ endpoint. Each flush of each
+# worker writes one part file; once a day is over its parts are compacted into a
+# single file, so the flush interval only bounds the current day's file count.
+PREDICTION_LOG_ENABLED = os.environ.get('PREDICTION_LOG_ENABLED', 'True') == 'True'
+PREDICTION_LOG_DIR = os.environ.get('PREDICTION_LOG_DIR', os.path.join(BASE_DIR, 'prediction_log'))
+PREDICTION_LOG_BATCH_SIZE = int(os.environ.get('PREDICTION_LOG_BATCH_SIZE', '500'))  # Rows per flush
+PREDICTION_LOG_FLUSH_INTERVAL = float(os.environ.get('PREDICTION_LOG_FLUSH_INTERVAL', '30'))  # Seconds
+
+# Profiling settings
+# Staff users can profile a single /predict/ request with the `X-Profile: 1` header
+# or `?profile=1`; profiles are listed at /profiles/.
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'True') == 'True'
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))  # Seconds between samples
 
 # Crispy Forms
 CRISPY_ALLOWED_TEMPLATE_PACKS = "bootstrap5"